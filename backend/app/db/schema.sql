@@ -103,9 +103,14 @@ CREATE TABLE IF NOT EXISTS learning_logs (
 );
 
 -- Indexes for performance
-CREATE INDEX IF NOT EXISTS idx_evaluations_exam_id ON evaluations(exam_id);
+-- (exam_id, roll_no) serves per-exam scans, roll-ordered exports and single-student lookups
+DROP INDEX IF EXISTS idx_evaluations_exam_id;
+CREATE INDEX IF NOT EXISTS idx_evaluations_exam_roll ON evaluations(exam_id, roll_no);
+-- Covers the history aggregate (GROUP BY exam_id over these columns) with an index-only scan
+CREATE INDEX IF NOT EXISTS idx_evaluations_history ON evaluations(exam_id, timestamp DESC) INCLUDE (total, subject, batch, department);
 CREATE INDEX IF NOT EXISTS idx_details_department ON details(department);
 CREATE INDEX IF NOT EXISTS idx_students_dept_batch ON students(department, batch);
+CREATE INDEX IF NOT EXISTS idx_students_lower_dept_batch ON students(LOWER(department), batch);
 CREATE INDEX IF NOT EXISTS idx_qp_created_at ON question_papers(created_at DESC);
 CREATE INDEX IF NOT EXISTS idx_evaluations_roll_no ON evaluations(roll_no);
 CREATE INDEX IF NOT EXISTS idx_progress_student ON student_progress(student_id);
@@ -9,15 +9,17 @@ from dotenv import load_dotenv
 import io
 import logging
 import time
+from functools import lru_cache
 
 # Load environment variables from backend/.env
 load_dotenv(Path(__file__).parent.parent / ".env")
 
 from fastapi import FastAPI, Request, HTTPException, UploadFile, File, Form, status
-from fastapi.responses import RedirectResponse, FileResponse, JSONResponse
+from fastapi.responses import RedirectResponse, JSONResponse, ORJSONResponse, Response
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+from urllib.parse import quote
 
 import core.database as db_module
 import services.question_generator as qg
@@ -29,7 +31,7 @@ from docx import Document
 from docx.text.paragraph import Paragraph
 
 # --- IMPORT EVALUATOR ---
-from routers.evaluator import evaluator_app
+from routers.evaluator import evaluator_app, shutdown_parse_pool
 
 # --- CONFIGURATION ---
 logging.basicConfig(level=logging.INFO)
@@ -51,7 +53,7 @@ TEMPLATE_PATHS = {
 }
 
 # --- FASTAPI APP SETUP ---
-app = FastAPI(title="Question Paper Generator", version="2.0")
+app = FastAPI(title="Question Paper Generator", version="2.0", default_response_class=ORJSONResponse)
 
 # --- CORS ---
 app.add_middleware(
@@ -76,6 +78,23 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
     )
 
 # --- Database lifecycle (PostgreSQL via asyncpg) ---
+@app.on_event("startup")
+async def startup():
+    # Only the pool is created here; schema setup stays an explicit init_db() step so
+    # several workers never run DDL against live tables at once
+    try:
+        # Warm the pool so the first real request doesn't pay the connection handshake
+        pool = await db_module.get_pool()
+        await pool.execute("SELECT 1")
+    except Exception as e:
+        logger.error(f"Database startup failed: {e}")
+
+@app.on_event("shutdown")
+async def shutdown():
+    # The mounted evaluator sub-app gets no lifecycle events of its own
+    shutdown_parse_pool()
+    await db_module.close_db()
+
 # --- AUTH CONFIG ---
 # JWT Removed as per request
 
@@ -178,7 +197,8 @@ async def generate_questions(request: Request):
         exam_type = "Model" if data.get("exam_type") == "Models" else data.get("exam_type")
         
         # Use QG
-        doc_chunks = qg.create_document_chunks(data.get("selected_units", []))
+        # Splitting and hashing the syllabus text is CPU work; keep it off the event loop
+        doc_chunks = await asyncio.to_thread(qg.create_document_chunks, data.get("selected_units", []))
         if not doc_chunks: raise HTTPException(status_code=422, detail="Failed to process content.")
         
         # Get selected topics
@@ -247,24 +267,31 @@ except Exception as e:
     logger.error(f"Failed to load MML2OMML.xsl: {e}")
     xslt_transform = None
 
-def latex_to_omml(latex_str):
+@lru_cache(maxsize=4096)
+def _latex_to_omml_xml(latex_str: str) -> str | None:
+    """Converts LaTeX to serialized OMML. Cached since the same tokens ($x$, $n$...) recur across a paper."""
     if not xslt_transform: return None
     try:
         mathml = latex2mathml.converter.convert(latex_str)
         mathml_tree = etree.fromstring(mathml)
         omml_tree = xslt_transform(mathml_tree)
-        return omml_tree
+        return etree.tostring(omml_tree, encoding='unicode')
     except Exception as e:
         logger.error(f"Math conversion failed for '{latex_str}': {e}")
         return None
 
-def replace_text_in_paragraph(paragraph: Paragraph, context: Dict[str, str]):
+def compile_placeholders(context: Dict[str, str]) -> Optional[re.Pattern]:
+    """One alternation over all placeholder keys, longest first; None if there is nothing to replace."""
+    if not context: return None
+    return re.compile("|".join(re.escape(k) for k in sorted(context, key=len, reverse=True)))
+
+def replace_text_in_paragraph(paragraph: Paragraph, context: Dict[str, str], placeholder_re: Optional[re.Pattern]):
+    if placeholder_re is None: return
     full_text = "".join(run.text for run in paragraph.runs)
-    if '{{' not in full_text: return
+    if '{{' not in full_text or not placeholder_re.search(full_text): return
     
     # Perform Replacement
-    for key, value in context.items():
-        if key in full_text: full_text = full_text.replace(key, str(value))
+    full_text = placeholder_re.sub(lambda m: str(context[m.group(0)]), full_text)
     
     # Check if there is any LaTeX to render ($...$)
     segments = re.split(r'(\$.*?\$)', full_text)
@@ -280,11 +307,10 @@ def replace_text_in_paragraph(paragraph: Paragraph, context: Dict[str, str]):
         # Check if math
         if segment.startswith('$') and segment.endswith('$') and len(segment) > 2:
             latex_content = segment[1:-1] # Strip $
-            omml_element = latex_to_omml(latex_content)
+            omml_xml_str = _latex_to_omml_xml(latex_content)
             
-            if omml_element is not None:
+            if omml_xml_str:
                 from docx.oxml import parse_xml
-                omml_xml_str = etree.tostring(omml_element, encoding='unicode')
                 try:
                     oxml_obj = parse_xml(omml_xml_str)
                     paragraph._p.append(oxml_obj)
@@ -303,48 +329,55 @@ def replace_text_in_paragraph(paragraph: Paragraph, context: Dict[str, str]):
             else:
                 paragraph.add_run(segment)
 
-def replace_placeholders(doc: Document, context: Dict[str, str]):
-    for p in doc.paragraphs: replace_text_in_paragraph(p, context)
-    for table in doc.tables:
+def _iter_table_paragraphs(tables):
+    for table in tables:
         for row in table.rows:
             for cell in row.cells:
-                for p in cell.paragraphs: replace_text_in_paragraph(p, context)
+                yield from cell.paragraphs
+
+def _iter_all_paragraphs(doc: Document):
+    """Yields every paragraph in the body, body tables, and section headers/footers."""
+    yield from doc.paragraphs
+    yield from _iter_table_paragraphs(doc.tables)
     for section in doc.sections:
-        for p in section.header.paragraphs: replace_text_in_paragraph(p, context)
-        for table in section.header.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for p in cell.paragraphs: replace_text_in_paragraph(p, context)
-        for p in section.footer.paragraphs: replace_text_in_paragraph(p, context)
-        for table in section.footer.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for p in cell.paragraphs: replace_text_in_paragraph(p, context)
+        for part in (section.header, section.footer):
+            yield from part.paragraphs
+            yield from _iter_table_paragraphs(part.tables)
+
+def replace_placeholders(doc: Document, context: Dict[str, str], placeholder_re: re.Pattern = None):
+    if placeholder_re is None: placeholder_re = compile_placeholders(context)
+    if placeholder_re is None: return doc
+    for p in _iter_all_paragraphs(doc): replace_text_in_paragraph(p, context, placeholder_re)
     return doc
 
+DOCX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+def docx_response(doc: Document, filename: str) -> Response:
+    """Serializes the document in memory and returns it as an attachment."""
+    buf = io.BytesIO()
+    doc.save(buf)
+    return Response(
+        content=buf.getvalue(),
+        media_type=DOCX_MEDIA_TYPE,
+        headers={"Content-Disposition": f"attachment; filename*=utf-8''{quote(filename)}"}
+    )
+
+# One line of a rubric: body text with an optional trailing "(3)" / "(3 marks)" allocation
+_MARK_LINE_RE = re.compile(r'^[^\S\n]*(?P<body>.*?)[^\S\n]*(?:\((?P<mk>\d+(?:\.\d+)?)(?:[^\S\n]*marks?)?\))?[^\S\n]*$', re.MULTILINE | re.IGNORECASE)
+
 def parse_answer_and_marks(answer_text: str):
     if not answer_text: return "", ""
-    lines = answer_text.strip().split('\n')
     cleaned_answer_lines = []
     formatted_marks_lines = []
-    mark_pattern = re.compile(r'\s*\((\d+(?:\.\d+)?)(?:\s*marks?)?\)\s*$', re.IGNORECASE)
 
-    for line in lines:
-        line = line.strip()
-        if line.startswith('**Keywords') or line.startswith('Keywords'):
-            cleaned_answer_lines.append(line)
+    for match in _MARK_LINE_RE.finditer(answer_text.strip()):
+        body, mark_number = match.group('body'), match.group('mk')
+        if body.startswith(('**Keywords', 'Keywords')):
+            cleaned_answer_lines.append(match.group(0).strip())
             formatted_marks_lines.append("")
-            continue
-            
-        match = mark_pattern.search(line)
-        if match:
-            mark_number = match.group(1)
-            formatted_marks_lines.append(f"({mark_number})")
-            cleaned_line = mark_pattern.sub('', line).strip()
-            cleaned_answer_lines.append(cleaned_line)
         else:
-            cleaned_answer_lines.append(line)
-            formatted_marks_lines.append("")
+            cleaned_answer_lines.append(body)
+            formatted_marks_lines.append(f"({mark_number})" if mark_number else "")
 
     return "\n".join(cleaned_answer_lines), "\n".join(formatted_marks_lines)
 
@@ -388,10 +421,8 @@ async def download_paper(data: DownloadRequest):
         context[f"{{{{Q{q_num}b}}}}"] = long_essays[i + 1].text if i + 1 < len(long_essays) else ""
         q_num += 1
 
-    doc = replace_placeholders(doc, context)
-    file_path = TEMP_DIR / f"{data.subject}_QP_{random.randint(1000,9999)}.docx"
-    doc.save(file_path)
-    return FileResponse(path=file_path, filename=f"{data.subject}_Question_Paper.docx")
+    doc = replace_placeholders(doc, context, compile_placeholders(context))
+    return docx_response(doc, f"{data.subject}_Question_Paper.docx")
 
 @app.post("/download-key")
 async def download_key(data: DownloadRequest):
@@ -435,15 +466,19 @@ async def download_key(data: DownloadRequest):
             context[f"{{{{M{q_num}b}}}}"] = m2
         q_num += 1
         
-    doc = replace_placeholders(doc, context)
-    file_path = TEMP_DIR / f"{data.subject}_Key_{random.randint(1000,9999)}.docx"
-    doc.save(file_path)
-    return FileResponse(path=file_path, filename=f"{data.subject}_Answer_Key.docx")
+    doc = replace_placeholders(doc, context, compile_placeholders(context))
+    return docx_response(doc, f"{data.subject}_Answer_Key.docx")
 
 if __name__ == "__main__":
     import uvicorn
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--port", type=int, default=8000)
+    # One worker by default: each worker process has its own DB pool, MiniLM copy and
+    # Gemini rate limit (GEMINI_RPM is per process), so scale out deliberately
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")))
     args = parser.parse_args()
-    uvicorn.run(app, host="0.0.0.0", port=args.port)
\ No newline at end of file
+    # Workers read this to split CPU threads between them (see routers/evaluator.py)
+    os.environ["WEB_CONCURRENCY"] = str(args.workers)
+    # loop/http "auto" pick uvloop and httptools when installed (uvicorn[standard])
+    uvicorn.run("main:app", host="0.0.0.0", port=args.port, workers=args.workers, loop="auto", http="auto")
\ No newline at end of file
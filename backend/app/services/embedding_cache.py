@@ -0,0 +1,87 @@
+"""
+embedding_cache.py — Persistent SQLite cache for sentence embeddings.
+Model answers/rubrics rarely change between evaluation runs, so their
+MiniLM vectors are stored once and reused across papers and restarts.
+"""
+
+import os
+import hashlib
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH",
+    str(Path(__file__).resolve().parent.parent / "temp" / "embedding_cache.sqlite3")
+)
+
+
+class EmbeddingCache:
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (hash TEXT PRIMARY KEY, vec BLOB NOT NULL)")
+        return self._conn
+
+    @staticmethod
+    def _key(model_name: str, text: str) -> str:
+        # Model name is part of the key so switching models never returns stale vectors
+        return f"{model_name}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def get_or_encode(self, model, texts: List[str], model_name: str) -> np.ndarray:
+        """
+        Returns L2-normalized float32 embeddings for texts (input order).
+        Only cache misses are encoded, in a single batch.
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        keys = [self._key(model_name, t) for t in texts]
+
+        with self._lock:
+            conn = self._connect()
+            found = {}
+            unique_keys = list(dict.fromkeys(keys))
+            for i in range(0, len(unique_keys), 500):
+                chunk = unique_keys[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT hash, vec FROM embeddings WHERE hash IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update((h, np.frombuffer(v, dtype=np.float32)) for h, v in rows)
+
+        misses = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in misses:
+                misses[key] = text
+
+        if misses:
+            vecs = model.encode(list(misses.values()), batch_size=64, convert_to_numpy=True, normalize_embeddings=True)
+            vecs = np.asarray(vecs, dtype=np.float32)
+            new_rows = list(zip(misses.keys(), vecs))
+            found.update(new_rows)
+            try:
+                with self._lock:
+                    conn = self._connect()
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO embeddings (hash, vec) VALUES (?, ?)",
+                        [(h, v.tobytes()) for h, v in new_rows]
+                    )
+                    conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Embedding cache write failed: {e}")
+
+        return np.stack([found[k] for k in keys])
+
+
+embedding_cache = EmbeddingCache()
@@ -1,13 +1,16 @@
 import os
 import re
 import json
-import random
+import asyncio
+import hashlib
 import logging
-import pdfplumber
+import orjson
+import numpy as np
 import pytesseract
 from pdf2image import convert_from_path
 from typing import List, Dict, Any
 from pathlib import Path
+from functools import lru_cache
 
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.prompts import PromptTemplate
@@ -15,6 +18,8 @@ from langchain_core.output_parsers import StrOutputParser
 from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
 import google.generativeai as genai
 from services.graph_service import graph_engine
+from utils.document_utils import extract_pdf_text
+from utils.rate_limit import GENERATION_RATE_LIMIT
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -32,8 +37,15 @@ try:
     # Updated to raw SDK in run_batch_query
     embedding = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004")
 except Exception as e:
+    embedding = None
     logger.error(f"Failed to initialize embeddings: {e}")
 
+# Caps in-flight Gemini generation calls (section batches plus their top-ups)
+GENERATION_CONCURRENCY = asyncio.Semaphore(int(os.getenv("GENERATION_CONCURRENCY", "8")))
+
+# JSON mode: Gemini returns bare JSON, so parsing rarely needs the regex fallbacks
+JSON_GENERATION_CONFIG = {"response_mime_type": "application/json"}
+
 # --- PROMPTS ---
 MCQ_BATCH_PROMPT = PromptTemplate.from_template("""
 You are an expert question paper setter for {subject}. 
@@ -93,36 +105,62 @@ Return a single, valid JSON object:
 
 # --- FUNCTIONS ---
 
+# Valid JSON escapes pass through untouched; any other backslash (e.g. LaTeX "$\sigma$") gets doubled.
+_JSON_ESCAPE_RE = re.compile(r'\\(["\\/bfnrt]|u[0-9a-fA-F]{4})|\\(.)', re.DOTALL)
+_JSON_OBJECT_RE = re.compile(r'(\{[\s\S]*\})')
+_JSON_LIST_RE = re.compile(r'(\[[\s\S]*\])')
+_CODE_BLOCK_RE = re.compile(r'```(?:json)?\s*([\s\S]*?)\s*```')
+_OPEN_CODE_BLOCK_RE = re.compile(r'```(?:json)?\s*([\s\S]*)')
+
+def _fix_json_escape(match: re.Match) -> str:
+    return match.group(0) if match.group(1) else '\\\\' + match.group(2)
+
+def loads_json(text: str) -> Any:
+    """Parses JSON with orjson, falling back to the (non-strict) stdlib parser for LLM output orjson rejects."""
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        pass
+    try:
+        return json.loads(text, strict=False)
+    except json.JSONDecodeError:
+        return json.loads(_JSON_ESCAPE_RE.sub(_fix_json_escape, text), strict=False)
+
 def parse_json_output(response_text: str) -> List[Dict[str, str]]:
     try:
         data = None
-        json_obj_match = re.search(r'(\{[\s\S]*\})', response_text)
+        try:
+            data = loads_json(response_text)
+        except ValueError:
+            pass
+
+        json_obj_match = _JSON_OBJECT_RE.search(response_text) if data is None else None
         if json_obj_match:
             try:
-                data = json.loads(json_obj_match.group(1))
+                data = loads_json(json_obj_match.group(1))
             except:
                 pass
 
         if data is None:
-            json_list_match = re.search(r'(\[[\s\S]*\])', response_text)
+            json_list_match = _JSON_LIST_RE.search(response_text)
             if json_list_match:
                 try:
-                    data = json.loads(json_list_match.group(1))
+                    data = loads_json(json_list_match.group(1))
                 except:
                     pass
 
         if data is None:
              # Try matching code block with closing fence
-             match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', response_text)
+             match = _CODE_BLOCK_RE.search(response_text)
              if match:
                  try:
-                     data = json.loads(match.group(1))
+                     data = loads_json(match.group(1))
                  except:
                      pass
 
         if data is None:
              # Fallback: Try matching start of code block to end of string (handling truncated response)
-             match = re.search(r'```(?:json)?\s*([\s\S]*)', response_text)
+             match = _OPEN_CODE_BLOCK_RE.search(response_text)
              if match:
                  candidate = match.group(1).strip()
                  # Attempt to find the last closing brace/bracket
@@ -133,7 +171,7 @@ def parse_json_output(response_text: str) -> List[Dict[str, str]]:
                  if end_idx != -1:
                      candidate = candidate[:end_idx+1]
                      try:
-                         data = json.loads(candidate)
+                         data = loads_json(candidate)
                      except:
                          pass
 
@@ -163,28 +201,60 @@ def parse_json_output(response_text: str) -> List[Dict[str, str]]:
         logger.error(f"Parse error: {e}")
         return []
 
+def partial_batch_prompt(prompt_template: PromptTemplate, context: str, subject: str, difficulty: str, topics: List[str] = None) -> PromptTemplate:
+    """Binds the per-paper variables once so every section reuses the same context rendering."""
+    topics_instruction = ""
+    if topics:
+        topics_list = ", ".join(topics)
+        topics_instruction = f"**STRICT CONSTRAINT**: You must ONLY generate questions related to the following topics: {topics_list}. Do NOT generate questions from any other topics found in the context."
+    
+    return prompt_template.partial(
+        subject=subject,
+        difficulty=difficulty,
+        context=context,
+        topics_instruction=topics_instruction
+    )
+
 async def run_batch_query(prompt_template: PromptTemplate, q_type: str, num: int, marks: int, context: str, subject: str, difficulty: str, topics: List[str] = None) -> List[Dict[str, str]]:
     if num <= 0: return []
+    prompt = partial_batch_prompt(prompt_template, context, subject, difficulty, topics)
+    return await run_prepared_batch_query(prompt, q_type, num, marks)
+
+_QUESTION_NORM_RE = re.compile(r'\W+')
+
+def dedupe_questions(questions: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Drops repeats whose text only differs in case, punctuation or spacing."""
+    seen = set()
+    unique = []
+    for q in questions:
+        key = _QUESTION_NORM_RE.sub(" ", str(q.get("text", ""))).strip().lower()
+        if key and key in seen:
+            continue
+        seen.add(key)
+        unique.append(q)
+    return unique
+
+async def run_prepared_batch_query(prompt: PromptTemplate, q_type: str, num: int, marks: int) -> List[Dict[str, str]]:
+    """
+    One batch call for the whole section; any shortfall (truncated or duplicate
+    items) is then topped up with concurrent single-question calls instead of
+    regenerating the batch.
+    """
+    if num <= 0: return []
+    questions = dedupe_questions(await _query_batch(prompt, q_type, num, marks))
+    missing = num - len(questions)
+    if missing > 0 and questions:
+        logger.info(f"Topping up {missing} missing {q_type} questions...")
+        extra = await asyncio.gather(*[_query_batch(prompt, q_type, 1, marks) for _ in range(missing)])
+        questions = dedupe_questions(questions + [q for batch in extra for q in batch])
+    return questions[:num]
+
+async def _query_batch(prompt: PromptTemplate, q_type: str, num: int, marks: int) -> List[Dict[str, str]]:
     try:
         logger.info(f"Generating {num} {q_type} questions using raw SDK...")
         
-        topics_instruction = ""
-        if topics:
-            topics_list = ", ".join(topics)
-            topics_instruction = f"**STRICT CONSTRAINT**: You must ONLY generate questions related to the following topics: {topics_list}. Do NOT generate questions from any other topics found in the context."
-        
-        input_vars = {
-            "subject": subject, 
-            "num_questions": num, 
-            "question_type": q_type,
-            "difficulty": difficulty, 
-            "marks": marks, 
-            "context": context,
-            "topics_instruction": topics_instruction
-        }
-        
         # Format prompt using the LangChain template but we'll send it raw
-        full_prompt = prompt_template.format(**input_vars)
+        full_prompt = prompt.format(num_questions=num, question_type=q_type, marks=marks)
 
         models_to_try = [
             ("gemini-3-flash-preview", "PRIMARY"),
@@ -196,7 +266,9 @@ async def run_batch_query(prompt_template: PromptTemplate, q_type: str, num: int
             try:
                 logger.info(f"Attempting {label} with {model_name}...")
                 model = genai.GenerativeModel(model_name)
-                response = await model.generate_content_async(full_prompt)
+                await GENERATION_RATE_LIMIT.acquire()
+                async with GENERATION_CONCURRENCY:
+                    response = await model.generate_content_async(full_prompt, generation_config=JSON_GENERATION_CONFIG)
                 
                 if response and response.text:
                     questions = parse_json_output(response.text)
@@ -222,7 +294,7 @@ async def run_batch_query(prompt_template: PromptTemplate, q_type: str, num: int
 def clean_json_string(text: str) -> str:
     try:
         # Remove code blocks
-        match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', text)
+        match = _CODE_BLOCK_RE.search(text)
         if match:
             text = match.group(1)
             
@@ -262,13 +334,13 @@ async def extract_topics_from_text(text: str, subject: str = "General") -> List[
         Text: {text[:2000]}...
         """
         model = genai.GenerativeModel('gemini-2.5-flash')
-        response = await model.generate_content_async(prompt)
+        await GENERATION_RATE_LIMIT.acquire()
+        response = await model.generate_content_async(prompt, generation_config=JSON_GENERATION_CONFIG)
         cleaned = clean_json_string(response.text) 
-        topics = json.loads(cleaned)
+        topics = loads_json(cleaned)
         
         # Background sync to Neo4j so it doesn't fail the main request
         if topics:
-            import asyncio
             for t in topics:
                 asyncio.create_task(graph_engine.create_topic(subject, t))
             
@@ -297,9 +369,10 @@ async def sync_knowledge_graph(subject: str, topics: List[str]):
         If no prerequisites, return empty list for that topic.
         """
         model = genai.GenerativeModel('gemini-2.5-flash')
-        response = await model.generate_content_async(prompt)
+        await GENERATION_RATE_LIMIT.acquire()
+        response = await model.generate_content_async(prompt, generation_config=JSON_GENERATION_CONFIG)
         cleaned = clean_json_string(response.text)
-        mapping = json.loads(cleaned)
+        mapping = loads_json(cleaned)
         
         for item in mapping:
             t_name = item.get("topic")
@@ -327,21 +400,33 @@ def ocr_pdf_with_tesseract(pdf_path: str) -> str:
         logger.error(f"Tesseract OCR failed: {e}")
         return ""
 
+# Syllabus file digest + subject -> extracted units, so re-uploading the same PDF skips the Gemini call
+_UNITS_CACHE: Dict[str, List[Dict[str, Any]]] = {}
+_UNITS_CACHE_SIZE = 64
+
+def _file_digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
 async def extract_units_and_topics_unified(pdf_path: str, subject: str = "Syllabus") -> List[Dict[str, Any]]:
     """
     Consolidates Unit and Topic extraction into a SINGLE Gemini call.
     """
     try:
+        cache_key = f"{subject}:{await asyncio.to_thread(_file_digest, pdf_path)}"
+        if cache_key in _UNITS_CACHE:
+            logger.info("Syllabus already processed, reusing extracted units.")
+            return _UNITS_CACHE[cache_key]
+
         full_text = ""
         try:
-            with pdfplumber.open(pdf_path) as pdf:
-                full_text = "".join(page.extract_text() or "" for page in pdf.pages)
+            full_text = await asyncio.to_thread(extract_pdf_text, pdf_path)
         except Exception as e:
-            logger.error(f"PDFPlumber failed: {e}")
+            logger.error(f"PDF text extraction failed: {e}")
 
         if not full_text or len(full_text.strip()) < 100:
             logger.warning("PDF appears to be scanned. Attempting Tesseract OCR...")
-            full_text = ocr_pdf_with_tesseract(pdf_path)
+            full_text = await asyncio.to_thread(ocr_pdf_with_tesseract, pdf_path)
             if not full_text: return []
 
         logger.info("Extracting Units and Topics in a single Gemini (3-Flash) call...")
@@ -367,19 +452,23 @@ async def extract_units_and_topics_unified(pdf_path: str, subject: str = "Syllab
         """
         
         model = genai.GenerativeModel('gemini-2.5-flash')
-        response = await model.generate_content_async(prompt)
+        await GENERATION_RATE_LIMIT.acquire()
+        response = await model.generate_content_async(prompt, generation_config=JSON_GENERATION_CONFIG)
         cleaned = clean_json_string(response.text)
-        units_data = json.loads(cleaned)
+        units_data = loads_json(cleaned)
         
         # Background sync to Knowledge Graph
         if units_data:
-            import asyncio
             all_topics = []
             for u in units_data:
                 all_topics.extend(u.get("topics", []))
             
             # Use passed subject name for Knowledge Graph isolation
             asyncio.create_task(sync_knowledge_graph(subject, all_topics))
+
+            if len(_UNITS_CACHE) >= _UNITS_CACHE_SIZE:
+                _UNITS_CACHE.pop(next(iter(_UNITS_CACHE)))
+            _UNITS_CACHE[cache_key] = units_data
             
         return units_data
     except Exception as e:
@@ -390,11 +479,83 @@ async def extract_units_and_topics_unified(pdf_path: str, subject: str = "Syllab
 async def extract_units_from_pdf(pdf_path: str, subject: str = "Syllabus") -> List[Dict[str, Any]]:
     return await extract_units_and_topics_unified(pdf_path, subject)
 
+# Smaller chunks keep the selected context dense; the shared context is sent
+# with every section prompt, so it is capped as well.
+CHUNK_SIZE = 2000
+CHUNK_OVERLAP = 200
+MAX_CONTEXT_CHARS = 8000
+
+# Chunks keyed by a hash of the selected units, so regenerating a paper
+# against the same syllabus skips re-splitting. Oldest entry is evicted first.
+_CHUNK_CACHE: Dict[str, List[Any]] = {}
+_CHUNK_CACHE_SIZE = 64
+
 def create_document_chunks(units: List[Dict[str, Any]]) -> List[Any]:
-    texts = [unit["text"] for unit in units if unit.get("text")]
-    if not texts: return []
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=4000, chunk_overlap=500)
-    return text_splitter.create_documents(texts, metadatas=[{"unit": unit["unit"]} for unit in units])
+    units = [unit for unit in units if unit.get("text")]
+    if not units: return []
+    pairs = [(unit.get("unit"), unit["text"]) for unit in units]
+    key = hashlib.blake2b(orjson.dumps(pairs), digest_size=16).hexdigest()
+    cached = _CHUNK_CACHE.get(key)
+    if cached is not None: return cached
+
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    chunks = text_splitter.create_documents([text for _, text in pairs], metadatas=[{"unit": name} for name, _ in pairs])
+    # Units often share boilerplate (outcomes, references); identical chunks would only repeat prompt tokens
+    seen = set()
+    chunks = [
+        chunk for chunk in chunks
+        if (digest := hashlib.blake2b(chunk.page_content.strip().encode("utf-8"), digest_size=16).digest()) not in seen
+        and not seen.add(digest)
+    ]
+    if len(_CHUNK_CACHE) >= _CHUNK_CACHE_SIZE:
+        _CHUNK_CACHE.pop(next(iter(_CHUNK_CACHE)))
+    _CHUNK_CACHE[key] = chunks
+    return chunks
+
+@lru_cache(maxsize=64)
+def _embed_chunks(docs_content: tuple) -> np.ndarray:
+    """Batch-embeds the chunk texts once per distinct chunk set (L2-normalized rows)."""
+    vecs = np.asarray(embedding.embed_documents(list(docs_content)), dtype=np.float32)
+    return vecs / (np.linalg.norm(vecs, axis=1, keepdims=True) + 1e-12)
+
+def _mmr_select(doc_vecs: np.ndarray, query_vec: np.ndarray, k: int, lambda_mult: float = 0.5) -> List[int]:
+    """Greedy maximal marginal relevance: relevant to the query, but not redundant with chunks already picked."""
+    query_vec = query_vec / (np.linalg.norm(query_vec) + 1e-12)
+    relevance = doc_vecs @ query_vec
+    similarity = doc_vecs @ doc_vecs.T
+    selected = [int(np.argmax(relevance))]
+    while len(selected) < min(k, len(doc_vecs)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * similarity[:, selected].max(axis=1)
+        scores[selected] = -np.inf
+        selected.append(int(np.argmax(scores)))
+    return selected
+
+async def select_context_chunks(docs_content: tuple, subject: str, topics: List[str] = None, k: int = 5) -> List[str]:
+    """Picks k diverse, relevant chunks. Deterministic, so identical requests build identical prompts."""
+    if len(docs_content) <= k: return list(docs_content)
+    if embedding is None: return list(docs_content[:k])
+    try:
+        doc_vecs = await asyncio.to_thread(_embed_chunks, docs_content)
+        if topics:
+            query = f"{subject}: {', '.join(topics)}"
+            query_vec = np.asarray(await asyncio.to_thread(embedding.embed_query, query), dtype=np.float32)
+        else:
+            query_vec = doc_vecs.mean(axis=0)
+        return [docs_content[i] for i in _mmr_select(doc_vecs, query_vec, k)]
+    except Exception as e:
+        logger.error(f"Context selection failed, using leading chunks: {e}")
+        return list(docs_content[:k])
+
+def join_context(chunks: List[str], budget: int = MAX_CONTEXT_CHARS, sep: str = "\n---\n") -> str:
+    """Joins whole chunks in order, stopping before one would push the context past budget."""
+    kept, used = [], 0
+    for chunk in chunks:
+        added = len(chunk) + (len(sep) if kept else 0)
+        # The first chunk is always kept so a prompt never goes out without context
+        if kept and used + added > budget: break
+        kept.append(chunk)
+        used += added
+    return sep.join(kept)
 
 async def generate_question_paper(docs_content: tuple, subject: str, pattern: str, difficulty: str, topics: List[str] = None) -> Dict[str, List]:
     patterns = {
@@ -408,37 +569,33 @@ async def generate_question_paper(docs_content: tuple, subject: str, pattern: st
     num_short, marks_short = config["short"]
     num_long, marks_long = config["long"]
     
-    context_sample = "\n---\n".join(random.sample(list(docs_content), min(len(docs_content), 5)))
+    context_sample = join_context(await select_context_chunks(tuple(docs_content), subject, topics))
     paper = {"MCQ": [], "Short": [], "Long": []}
     q_id_counter = 1
 
-    # Generate sections
-    raw_mcqs = await run_batch_query(MCQ_BATCH_PROMPT, "MCQ", num_mcq, marks_mcq, context_sample, subject, difficulty, topics)
-    for q in raw_mcqs:
-        if isinstance(q, dict):
-            q.update({"id": q_id_counter, "type": "MCQ", "marks": marks_mcq})
-            paper["MCQ"].append(q)
-            q_id_counter += 1
-
-    raw_shorts = await run_batch_query(RUBRIC_BATCH_PROMPT, "Short Answer", num_short * 2, marks_short, context_sample, subject, difficulty, topics)
-    for q in raw_shorts:
-        if isinstance(q, dict):
-            q.update({"id": q_id_counter, "type": "Short Answer", "marks": marks_short})
-            paper["Short"].append(q)
-            q_id_counter += 1
-
-    raw_longs = await run_batch_query(RUBRIC_BATCH_PROMPT, "Long Essay", num_long * 2, marks_long, context_sample, subject, difficulty, topics)
-    for q in raw_longs:
-        if isinstance(q, dict):
-            q.update({"id": q_id_counter, "type": "Long Essay", "marks": marks_long})
-            paper["Long"].append(q)
-            q_id_counter += 1
+    mcq_prompt = partial_batch_prompt(MCQ_BATCH_PROMPT, context_sample, subject, difficulty, topics)
+    rubric_prompt = partial_batch_prompt(RUBRIC_BATCH_PROMPT, context_sample, subject, difficulty, topics)
+
+    # The three sections are independent: request them concurrently
+    sections = [("MCQ", "MCQ", marks_mcq), ("Short", "Short Answer", marks_short), ("Long", "Long Essay", marks_long)]
+    raw_sections = await asyncio.gather(
+        run_prepared_batch_query(mcq_prompt, "MCQ", num_mcq, marks_mcq),
+        run_prepared_batch_query(rubric_prompt, "Short Answer", num_short * 2, marks_short),
+        run_prepared_batch_query(rubric_prompt, "Long Essay", num_long * 2, marks_long)
+    )
+
+    # Ids are assigned afterwards so numbering stays MCQ -> Short -> Long
+    for (section, q_type, marks), raw_questions in zip(sections, raw_sections):
+        for q in raw_questions:
+            if isinstance(q, dict):
+                q.update({"id": q_id_counter, "type": q_type, "marks": marks})
+                paper[section].append(q)
+                q_id_counter += 1
     
     # --- PHASE 3: Automated Graph Ingestion ---
     # Trigger background sync of topics and prerequisites
     if topics:
         try:
-            import asyncio
             asyncio.create_task(sync_knowledge_graph(subject, topics))
         except Exception as ge:
             logger.error(f"Failed to trigger KG Sync: {ge}")
@@ -0,0 +1,149 @@
+"""
+semantic_cache.py — Near-duplicate lookup for LLM grading results.
+Students often write semantically equivalent answers; when a new answer's
+embedding is close enough to one already graded for the same question,
+the stored result is reused instead of calling Gemini again.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_PATH = os.getenv(
+    "SEMANTIC_CACHE_PATH",
+    str(Path(__file__).resolve().parent.parent / "temp" / "grade_cache.npz")
+)
+
+
+class SemanticCache:
+    """
+    Exact inner-product index over L2-normalized answer vectors (cosine similarity),
+    with a parallel list of cached values. Every entry carries a scope (exam,
+    question, rubric) and lookups only compare against entries of the same scope,
+    so answers to different questions never share grades. Each entry also has a
+    content hash so verbatim repeats are answered without embedding anything.
+    Oldest entries are dropped past max_entries.
+    """
+
+    def __init__(self, path: str = SEMANTIC_CACHE_PATH, threshold: float = 0.95, max_entries: int = 50000):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._vecs: Optional[np.ndarray] = None
+        self._values: List[Dict[str, Any]] = []
+        self._keys: List[str] = []
+        self._scopes = np.array([], dtype=str)
+        self._exact: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.lower().split())
+
+    @classmethod
+    def exact_key(cls, scope: str, answer: str) -> str:
+        return hashlib.sha256(f"{scope}\0{cls.normalize(answer)}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Exact-match lookup by exact_key()."""
+        return self._exact.get(key)
+
+    def lookup(self, vecs: np.ndarray, scopes: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Returns the cached value for each query row, or None when no entry in the
+        row's scope is similar enough.
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(vecs)
+        with self._lock:
+            if self._vecs is None or not len(self._values) or not len(vecs):
+                return results
+            vecs = np.asarray(vecs, dtype=np.float32)
+            for scope in set(scopes):
+                rows = np.flatnonzero(self._scopes == scope)
+                if not len(rows):
+                    continue
+                queries = [i for i, s in enumerate(scopes) if s == scope]
+                sims = vecs[queries] @ self._vecs[rows].T
+                for i, row_sims in zip(queries, sims):
+                    best = int(row_sims.argmax())
+                    if row_sims[best] >= self.threshold:
+                        results[i] = self._values[rows[best]]
+        return results
+
+    def add(self, vecs: np.ndarray, values: List[Dict[str, Any]], keys: List[str], scopes: List[str]):
+        if not len(values):
+            return
+        vecs = np.asarray(vecs, dtype=np.float32)
+        with self._lock:
+            self._vecs = vecs if self._vecs is None else np.vstack([self._vecs, vecs])
+            self._values.extend(values)
+            self._keys.extend(keys)
+            self._scopes = np.concatenate([self._scopes, np.asarray(scopes, dtype=str)])
+            self._exact.update(zip(keys, values))
+            overflow = len(self._values) - self.max_entries
+            if overflow > 0:
+                self._vecs = self._vecs[overflow:]
+                self._values = self._values[overflow:]
+                self._keys = self._keys[overflow:]
+                self._scopes = self._scopes[overflow:]
+                self._exact = dict(zip(self._keys, self._values))
+
+    def save(self):
+        with self._lock:
+            if self._vecs is None:
+                return
+            # Written to a per-process temp file and renamed into place, so other
+            # workers never read a half-written cache
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+                with open(tmp_path, "wb") as f:
+                    np.savez(
+                        f,
+                        vecs=self._vecs,
+                        values=np.array([json.dumps(v) for v in self._values], dtype=str),
+                        keys=np.array(self._keys, dtype=str),
+                        scopes=self._scopes
+                    )
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.error(f"Failed to persist semantic cache: {e}")
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            # No pickles: every array is numeric or plain strings
+            with np.load(self.path, allow_pickle=False) as data:
+                if "scopes" not in data:
+                    logger.info("Discarding semantic cache in the old format.")
+                    return
+                self._vecs = data["vecs"].astype(np.float32)
+                self._values = [json.loads(v) for v in data["values"]]
+                self._keys = [str(k) for k in data["keys"]]
+                self._scopes = data["scopes"].astype(str)
+            self._exact = dict(zip(self._keys, self._values))
+            logger.info(f"Loaded {len(self._values)} cached grading results.")
+        except Exception as e:
+            logger.error(f"Failed to load semantic cache: {e}")
+            self._vecs, self._values, self._keys, self._exact = None, [], [], {}
+            self._scopes = np.array([], dtype=str)
+
+
+grade_cache = SemanticCache()
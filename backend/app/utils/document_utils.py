@@ -0,0 +1,195 @@
+"""
+document_utils.py — Text and table extraction for uploaded papers (DOCX/PDF).
+Kept free of model/API imports so the functions can run in worker processes.
+"""
+
+import re
+import logging
+import zipfile
+from typing import Dict, List
+
+import fitz  # PyMuPDF
+import pdfplumber
+from docx.oxml.ns import qn
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+_VALID_Q_RE = re.compile(r'^(\d+)')
+
+_W_BODY, _W_TBL, _W_TR, _W_TC, _W_P = qn('w:body'), qn('w:tbl'), qn('w:tr'), qn('w:tc'), qn('w:p')
+_W_R, _W_HYPERLINK = qn('w:r'), qn('w:hyperlink')
+_W_T, _W_TAB, _W_PTAB, _W_BR, _W_CR, _W_NBHYPHEN = qn('w:t'), qn('w:tab'), qn('w:ptab'), qn('w:br'), qn('w:cr'), qn('w:noBreakHyphen')
+_W_TCPR, _W_GRIDSPAN, _W_VMERGE, _W_VAL = qn('w:tcPr'), qn('w:gridSpan'), qn('w:vMerge'), qn('w:val')
+_W_TRPR, _W_GRIDBEFORE, _W_TYPE = qn('w:trPr'), qn('w:gridBefore'), qn('w:type')
+
+def _xml_run_text(r) -> str:
+    parts = []
+    for el in r.iterchildren(_W_T, _W_TAB, _W_PTAB, _W_BR, _W_CR, _W_NBHYPHEN):
+        if el.tag == _W_T:
+            parts.append(el.text or "")
+        elif el.tag in (_W_TAB, _W_PTAB):
+            parts.append("\t")
+        elif el.tag == _W_NBHYPHEN:
+            parts.append("-")
+        elif el.tag == _W_CR or el.get(_W_TYPE, "textWrapping") == "textWrapping":
+            parts.append("\n")
+    return "".join(parts)
+
+def _xml_paragraph_text(p) -> str:
+    """Same text python-docx's Paragraph.text gives: runs and hyperlinked runs, in order."""
+    parts = []
+    for child in p.iterchildren(_W_R, _W_HYPERLINK):
+        if child.tag == _W_R:
+            parts.append(_xml_run_text(child))
+        else:
+            parts.extend(_xml_run_text(r) for r in child.iterchildren(_W_R))
+    return "".join(parts)
+
+def _xml_cell_paragraphs(tc) -> List[str]:
+    return [_xml_paragraph_text(p) for p in tc.iterchildren(_W_P)]
+
+def _iter_xml_table_rows(tbl):
+    """
+    Yields the <w:tc> elements of each row the way python-docx's row.cells does:
+    horizontally merged cells repeat per grid column, and vertically merged
+    continuation cells resolve to the cell above.
+    """
+    above = {}
+    for tr in tbl.iterchildren(_W_TR):
+        grid_before = tr.find(f"{_W_TRPR}/{_W_GRIDBEFORE}")
+        col = int(grid_before.get(_W_VAL, 0)) if grid_before is not None else 0
+        cells, current = [], {}
+        for tc in tr.iterchildren(_W_TC):
+            tc_pr = tc.find(_W_TCPR)
+            span, v_merge = 1, None
+            if tc_pr is not None:
+                grid_span = tc_pr.find(_W_GRIDSPAN)
+                if grid_span is not None:
+                    span = int(grid_span.get(_W_VAL, 1))
+                v_merge = tc_pr.find(_W_VMERGE)
+            if v_merge is not None and v_merge.get(_W_VAL, "continue") == "continue":
+                tc = above.get(col, tc)
+            for offset in range(span):
+                current[col + offset] = tc
+            cells.extend([tc] * span)
+            col += span
+        above = current
+        yield cells
+
+# Uploaded files are untrusted: never expand entities or fetch external DTDs
+_XML_PARSER = etree.XMLParser(resolve_entities=False, no_network=True)
+
+def _document_body(file_path: str):
+    """Parses only word/document.xml from the zip; python-docx would also load styles, numbering, rels, etc."""
+    with zipfile.ZipFile(file_path) as z, z.open("word/document.xml") as f:
+        return etree.parse(f, _XML_PARSER).getroot().find(_W_BODY)
+
+def parse_docx_table_data(file_path: str, is_question_paper: bool = False) -> Dict[str, Dict]:
+    # Walks the table XML directly; building python-docx Table/_Cell/Paragraph
+    # proxies for every cell dominated parse time on large papers.
+    body = _document_body(file_path)
+    items = {} 
+
+    for tbl in body.iterchildren(_W_TBL):
+        for cells in _iter_xml_table_rows(tbl):
+            if len(cells) < 2: continue
+            
+            col0_text = "\n".join(_xml_cell_paragraphs(cells[0])).strip()
+            col1_paras = _xml_cell_paragraphs(cells[1])
+            col1_text = "\n".join(col1_paras)
+            if "Q.No" in col0_text or "Answers" in col1_text: continue
+
+            q_match = _VALID_Q_RE.match(col0_text)
+            if q_match:
+                q_id = q_match.group(1)
+                final_rubric_text = ""
+
+                # Answer Key Logic
+                if not is_question_paper and len(cells) > 2:
+                    mark_paras_raw = _xml_cell_paragraphs(cells[2])
+                    
+                    ans_paras = [t.strip() for t in col1_paras if t.strip()]
+                    mark_paras = [t.strip() for t in mark_paras_raw if t.strip()]
+                    
+                    # Strategy A: Intelligent Line-by-Line Mapping
+                    if len(ans_paras) == len(mark_paras) and len(ans_paras) > 0:
+                        mapped_lines = []
+                        for txt, mk in zip(ans_paras, mark_paras):
+                            mapped_lines.append(f"{txt} [Value: {mk}]")
+                        final_rubric_text = "\n".join(mapped_lines)
+                    
+                    # Strategy B: Fallback (Just dump everything)
+                    else:
+                        # This ensures we NEVER lose the marks, even if formatting is weird
+                        raw_marks = "\n".join(mark_paras_raw).strip()
+                        final_rubric_text = f"{col1_text.strip()} [Rubric Breakdown: {raw_marks}]"
+                
+                else:
+                    final_rubric_text = col1_text.strip()
+
+                if q_id in items:
+                    prefix = " OR " if is_question_paper else "\n[OR Rubric]: "
+                    items[q_id]['text'] += f"{prefix}{final_rubric_text}"
+                else:
+                    items[q_id] = {'text': final_rubric_text}
+
+    return items
+
+# Plain-text mode without ligature preservation: "ﬁ" comes out as "fi", so keyword
+# and unit regexes match; no sorting/layout pass is requested
+_PDF_TEXT_FLAGS = fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_MEDIABOX_CLIP
+
+def extract_pdf_text(file_path: str) -> str:
+    """Raw PDF text via PyMuPDF (C-backed, no layout analysis); pdfplumber if that fails."""
+    try:
+        with fitz.open(file_path) as pdf:
+            return "\n".join(page.get_text("text", flags=_PDF_TEXT_FLAGS, sort=False) for page in pdf)
+    except Exception as e:
+        logger.warning(f"PyMuPDF failed on {file_path}, falling back to pdfplumber: {e}")
+    # Single extraction per page; the simple extractor skips pdfplumber's layout clustering
+    with pdfplumber.open(file_path) as pdf:
+        return "\n".join(text for page in pdf.pages if (text := page.extract_text_simple()))
+
+def extract_text(file_path: str) -> str:
+    """
+    Extracts text from PDF or DOCX files.
+    CRITICAL FIX: Reads text from BOTH paragraphs and tables in DOCX.
+    """
+    if file_path.endswith(".pdf"):
+        return extract_pdf_text(file_path)
+            
+    elif file_path.endswith(".docx"):
+        return extract_docx_text(file_path)
+                    
+    return ""
+
+def extract_docx_text(file_path: str) -> str:
+    """
+    Streams word/document.xml with iterparse instead of building the python-docx
+    object model. Body paragraphs come first, then table rows with their cells
+    joined by " | " (keeps answers written in grid layouts).
+    """
+    paragraphs, table_rows = [], []
+    with zipfile.ZipFile(file_path) as z, z.open("word/document.xml") as f:
+        for _, el in etree.iterparse(f, events=("end",), tag=(_W_P, _W_TBL), resolve_entities=False, no_network=True):
+            body = el.getparent()
+            # Nested paragraphs/tables are handled (and freed) with their top-level table
+            if body is None or body.tag != _W_BODY:
+                continue
+            if el.tag == _W_P:
+                if text := _xml_paragraph_text(el).strip():
+                    paragraphs.append(text)
+            else:
+                for cells in _iter_xml_table_rows(el):
+                    row_text = [
+                        cell_text for tc in cells
+                        if (cell_text := "\n".join(t for t in (p.strip() for p in _xml_cell_paragraphs(tc)) if t))
+                    ]
+                    if row_text:
+                        table_rows.append(" | ".join(row_text))
+            # Drop what has been consumed so memory stays flat on long scripts
+            el.clear()
+            while el.getprevious() is not None:
+                del body[0]
+    return "\n".join(paragraphs + table_rows)
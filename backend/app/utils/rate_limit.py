@@ -0,0 +1,49 @@
+"""
+rate_limit.py — Process-wide pacing for Gemini requests.
+Grading and question generation have separate budgets so an interactive
+paper generation never queues behind a whole grading run.
+"""
+
+import os
+import asyncio
+from typing import Optional
+
+
+class AsyncTokenBucket:
+    """
+    Token bucket: holds up to `burst` tokens and refills at rpm/60 tokens per second.
+    acquire() takes a token, sleeping (without blocking the event loop) until one is
+    available. A short burst goes out at once; sustained load is held to rpm.
+    Tokens are reserved in arrival order, so waiting callers are served FIFO.
+    """
+
+    def __init__(self, rpm: float, burst: int = 1):
+        self.rate = rpm / 60.0
+        self.capacity = float(max(1, burst))
+        self._tokens = self.capacity
+        self._updated: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            if self._updated is not None:
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Going negative reserves a future token; the deficit is the wait
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            await asyncio.sleep(wait)
+
+
+# Provider requests-per-minute budget for grading calls in this process
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "15"))
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", "3"))
+GEMINI_RATE_LIMIT = AsyncTokenBucket(GEMINI_RPM, GEMINI_BURST)
+
+# Question/syllabus generation: three sections plus top-ups arrive together, so the
+# default burst covers one paper
+GENERATION_RPM = float(os.getenv("GEMINI_GENERATION_RPM", "10"))
+GENERATION_BURST = int(os.getenv("GEMINI_GENERATION_BURST", "4"))
+GENERATION_RATE_LIMIT = AsyncTokenBucket(GENERATION_RPM, GENERATION_BURST)
@@ -1,7 +1,7 @@
 
 import logging
 import asyncio
-import json
+import orjson
 import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 import pytesseract
@@ -126,7 +126,7 @@ async def grade_pdf_with_vision(pdf_path: str, rubric_text: str, model_name: str
             elif "```" in text:
                  text = text.replace("```", "")
                  
-            return json.loads(text.strip())
+            return orjson.loads(text.strip())
             
         except Exception as e:
             logger.error(f"Failed to parse Gemini Vision response: {e}")
@@ -1,13 +1,17 @@
 # ✅ Simplified Version: Plain Text Batch Generation for Testing
 
 # Required installations:
-# !pip install llama-cpp-python pdfplumber streamlit langchain_core langchain_community
+# !pip install llama-cpp-python pymupdf streamlit langchain_core langchain_community
 
 import os
 import re
 import json
 import random
-import pdfplumber
+import time
+import hashlib
+import sqlite3
+import threading
+import fitz  # PyMuPDF
 import streamlit as st
 
 from langchain.text_splitter import RecursiveCharacterTextSplitter
@@ -26,15 +30,24 @@ if not os.path.exists(MODEL_PATH):
     st.error(f"Model file not found. Please download a model and update the MODEL_PATH variable in the script.")
     st.stop()
 
-try:
-    llm = LlamaCpp(
+# Loaded once per server process; Streamlit reruns the script on every widget change.
+@st.cache_resource(show_spinner="Loading local model...")
+def get_llm():
+    return LlamaCpp(
         model_path=MODEL_PATH,
-        n_gpu_layers=0,
+        n_gpu_layers=-1,  # offload every layer when llama.cpp is built with CUDA/Metal; ignored on CPU builds
         n_ctx=8192,
+        n_batch=1024,
+        # Decoding is memory-bound and scales to physical cores; prompt ingestion is compute-bound and uses them all
+        n_threads=max(1, (os.cpu_count() or 2) // 2),
+        model_kwargs={"n_threads_batch": os.cpu_count() or 1, "n_ubatch": 512},
         temperature=0.6,
         max_tokens=-1,
-        verbose=True,
+        verbose=False,
     )
+
+try:
+    llm = get_llm()
 except Exception as e:
     st.error(f"Failed to initialize the local Llama model. Error: {e}")
     st.stop()
@@ -59,12 +72,18 @@ CONTEXT:
 """)
 
 # --- UTILITY FUNCTIONS (Unchanged) ---
-def extract_units_from_pdf(pdf_path):
+UNIT_PATTERN = re.compile(r"((?:Unit|Module)[:\s]*\d+.*?(?=(?:Unit|Module)[:\s]*\d+|$))", re.DOTALL | re.IGNORECASE)
+# Same extraction flags as app/utils/document_utils.py, so both see identical syllabus text
+_PDF_TEXT_FLAGS = fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_MEDIABOX_CLIP
+
+def extract_units_from_pdf(pdf_source):
+    """pdf_source is a file path or the raw PDF bytes (e.g. straight from the uploader)."""
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            full_text = "\n".join([page.extract_text() for page in pdf.pages if page.extract_text() and page.extract_text().strip()])
-        unit_pattern = re.compile(r"((?:Unit|Module)[:\s]*\d+.*?(?=(?:Unit|Module)[:\s]*\d+|$))", re.DOTALL | re.IGNORECASE)
-        matches = unit_pattern.findall(full_text)
+        # Plain text, no layout analysis: the unit regex below doesn't need it
+        pdf_args = {"stream": pdf_source, "filetype": "pdf"} if isinstance(pdf_source, (bytes, bytearray)) else {"filename": pdf_source}
+        with fitz.open(**pdf_args) as pdf:
+            full_text = "\n".join(text for page in pdf if (text := page.get_text("text", flags=_PDF_TEXT_FLAGS, sort=False)).strip())
+        matches = UNIT_PATTERN.findall(full_text)
         if not matches: return [{"unit": "Full Syllabus", "text": full_text}] if full_text else []
         return [{"unit": f"Unit {idx+1}", "text": match.strip()} for idx, match in enumerate(matches)]
     except Exception as e:
@@ -75,27 +94,68 @@ def create_document_chunks(units):
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=4000, chunk_overlap=500)
     return text_splitter.create_documents(texts, metadatas=[{"unit": u["unit"]} for u in units])
 
+# --- PERSISTENT RESPONSE CACHE ---
+# Generated papers are kept on disk so a restart doesn't re-run the model.
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "./.llm_cache.sqlite3")
+
+@st.cache_resource
+def get_llm_cache():
+    """One connection shared by every session thread, so each use goes through the returned lock."""
+    conn = sqlite3.connect(LLM_CACHE_PATH, check_same_thread=False)
+    conn.execute("CREATE TABLE IF NOT EXISTS responses (hash TEXT PRIMARY KEY, response TEXT NOT NULL)")
+    return conn, threading.Lock()
+
+def content_hash(doc_chunks):
+    return hashlib.blake2b(b"\0".join(d.page_content.encode("utf-8") for d in doc_chunks), digest_size=16).hexdigest()
+
+def llm_cache_key(docs_hash, **params):
+    payload = json.dumps({"model": MODEL_PATH, "prompt": SIMPLE_TEXT_PROMPT.template, "docs": docs_hash, **params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
 # --- SIMPLIFIED BATCH GENERATION FUNCTION ---
-@st.cache_data(show_spinner=False)
-def generate_simple_question_paper(_docs_content, subject, pattern, difficulty):
+STREAM_RENDER_INTERVAL = 0.25
+
+def generate_simple_question_paper(doc_chunks, subject, pattern, difficulty, placeholder=None):
+    """Streams tokens into placeholder (an st.empty()) as they are generated."""
+    cache, cache_lock = get_llm_cache()
+    key = llm_cache_key(content_hash(doc_chunks), subject=subject, pattern=pattern, difficulty=difficulty)
+    with cache_lock:
+        row = cache.execute("SELECT response FROM responses WHERE hash = ?", (key,)).fetchone()
+    if row:
+        return row[0]
+
     config = {"CIA": {"mcq": 10, "short": 5, "long": 2}, "Model": {"mcq": 10, "short": 5, "long": 5}}[pattern]
     
     # Combine a few random chunks of the syllabus to create a rich context
-    context_sample = "\n---\n".join(random.sample(_docs_content, min(len(_docs_content), 5)))
+    # Sample indices so only the chosen chunks' text is touched
+    picked = random.sample(range(len(doc_chunks)), min(len(doc_chunks), 5))
+    context_sample = "\n---\n".join(doc_chunks[i].page_content for i in picked)
     
     # Create the chain
     chain = SIMPLE_TEXT_PROMPT | llm | StrOutputParser()
     
-    # Invoke the chain with all parameters to generate one single block of text
-    response_text = chain.invoke({
+    # Stream the chain so the paper appears while it is being written. Each
+    # markdown() call is a full re-render, so the placeholder is refreshed at
+    # most every STREAM_RENDER_INTERVAL seconds rather than once per token.
+    parts = []
+    last_render = time.monotonic()
+    for chunk in chain.stream({
         "subject": subject,
         "difficulty": difficulty,
         "num_mcq": config["mcq"],
         "num_short": config["short"],
         "num_long": config["long"],
         "context": context_sample
-    })
+    }):
+        parts.append(chunk)
+        if placeholder is not None and time.monotonic() - last_render >= STREAM_RENDER_INTERVAL:
+            placeholder.markdown("".join(parts))
+            last_render = time.monotonic()
+    response_text = "".join(parts)
     
+    with cache_lock:
+        cache.execute("INSERT OR REPLACE INTO responses (hash, response) VALUES (?, ?)", (key, response_text))
+        cache.commit()
     return response_text
 
 # --- Streamlit UI ---
@@ -110,12 +170,9 @@ with st.sidebar:
     uploaded_file = st.file_uploader("Upload Syllabus PDF", type="pdf")
 
 if uploaded_file:
-    temp_file_path = f"./temp_syllabus_{uploaded_file.file_id}.pdf"
-    with open(temp_file_path, "wb") as f:
-        f.write(uploaded_file.getvalue())
-
+    # Parsed from memory: no temp file to write, clean up, or collide on
     with st.spinner("Reading and analyzing syllabus..."):
-        units = extract_units_from_pdf(temp_file_path)
+        units = extract_units_from_pdf(uploaded_file.getvalue())
 
     if not units:
         st.error("Could not extract any text or units from the syllabus PDF.")
@@ -135,11 +192,10 @@ if uploaded_file:
                 if not doc_chunks:
                     st.error("Failed to process content from the selected units.")
                 else:
-                    doc_contents = tuple([doc.page_content for doc in doc_chunks])
-                    
-                    with st.spinner(f"Generating full question paper for {subject}... This may take a few minutes."):
-                        # Call the new, simplified generation function
-                        generated_paper = generate_simple_question_paper(doc_contents, subject, exam_type, difficulty)
+                    st.info(f"Generating full question paper for {subject}... This may take a few minutes.")
+                    live_output = st.empty()
+                    generated_paper = generate_simple_question_paper(doc_chunks, subject, exam_type, difficulty, placeholder=live_output)
+                    live_output.empty()
 
                     st.subheader("✅ Generation Complete!")
                     st.markdown(f"**Subject:** {subject} | **Exam Type:** {exam_type} | **Difficulty:** {difficulty}")
@@ -147,6 +203,3 @@ if uploaded_file:
                     
                     # Display the raw text output in a text area for easy viewing and copying
                     st.text_area("Generated Question Paper & Answers", generated_paper, height=600)
-
-    if os.path.exists(temp_file_path):
-        os.remove(temp_file_path)
\ No newline at end of file
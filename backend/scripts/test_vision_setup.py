@@ -1,6 +1,7 @@
 
 import os
 import sys
+import asyncio
 from dotenv import load_dotenv
 
 # Add current directory to path
@@ -22,11 +23,26 @@ if not api_key:
 
 print(f"API Key present: {api_key[:4]}***")
 
+VISION_MODEL = "gemini-3-flash-preview"
+EMBEDDING_MODEL = "models/text-embedding-004"
+
+def list_model_names():
+    return {m.name for m in genai.list_models()}
+
+def probe_embedding():
+    return len(genai.embed_content(model=EMBEDDING_MODEL, content="ping")["embedding"])
+
+async def run_checks():
+    # Independent endpoints: probe them concurrently instead of summing round-trips
+    return await asyncio.gather(asyncio.to_thread(list_model_names), asyncio.to_thread(probe_embedding))
+
 try:
     genai.configure(api_key=api_key)
-    # List models to check connectivity
-    model = genai.GenerativeModel('gemini-3-flash-preview')
-    print("Gemini configuration successful.")
+    model_names, embedding_dim = asyncio.run(run_checks())
+    if f"models/{VISION_MODEL}" not in model_names:
+        print(f"Gemini configuration failed: {VISION_MODEL} is not available for this key.")
+        sys.exit(1)
+    print(f"Gemini configuration successful ({len(model_names)} models, embedding dim {embedding_dim}).")
 except Exception as e:
     print(f"Gemini configuration failed: {e}")
     sys.exit(1)
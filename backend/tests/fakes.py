@@ -0,0 +1,28 @@
+"""Test doubles shared by the MiniLM triage and grade cache tests."""
+import hashlib
+
+import numpy as np
+
+
+def unit_vec(seed: int, dim: int = 384) -> np.ndarray:
+    v = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+
+class FakeMiniLM:
+    """
+    Returns the given embedding for known texts; any other text gets a deterministic
+    random unit vector. Every encoded text is recorded in seen.
+    """
+
+    def __init__(self, vectors=None, dim: int = 384):
+        self.vectors = vectors or {}
+        self.dim = dim
+        self.seen = []
+
+    def encode(self, texts, **kwargs):
+        self.seen.extend(texts)
+        return np.stack([
+            self.vectors[t] if t in self.vectors else unit_vec(int(hashlib.sha1(t.encode()).hexdigest()[:8], 16), self.dim)
+            for t in texts
+        ])
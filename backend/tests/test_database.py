@@ -0,0 +1,46 @@
+import sys
+import os
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import asyncpg
+
+# Add backend/app directory to sys.path so the core package resolves
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+import core.database as db_module
+
+
+def evaluation(roll_no: str) -> dict:
+    return {"roll_no": roll_no, "exam_id": "EXAM1", "marks": {"Q1": 1.0}, "feedback": {}, "total": 1.0, "department": "BCA"}
+
+
+class TestInsertEvaluations(unittest.IsolatedAsyncioTestCase):
+
+    async def test_batch_insert_returns_ids_in_order(self):
+        pool = MagicMock(fetch=AsyncMock(return_value=[{"id": 7}, {"id": 8}]))
+        with patch.object(db_module, "get_pool", AsyncMock(return_value=pool)):
+            ids = await db_module.insert_evaluations([evaluation("A"), evaluation("B")])
+        self.assertEqual(ids, [7, 8])
+
+    async def test_rejected_batch_falls_back_to_row_inserts(self):
+        """One bad row must not lose the rest of the batch."""
+        pool = MagicMock(fetch=AsyncMock(side_effect=asyncpg.ForeignKeyViolationError("fk")))
+
+        async def insert_one(record):
+            if record["roll_no"] == "BAD":
+                raise asyncpg.ForeignKeyViolationError("fk")
+            return {"A": 1, "C": 3}[record["roll_no"]]
+
+        with patch.object(db_module, "get_pool", AsyncMock(return_value=pool)), \
+                patch.object(db_module, "insert_evaluation", AsyncMock(side_effect=insert_one)):
+            ids = await db_module.insert_evaluations([evaluation("A"), evaluation("BAD"), evaluation("C")])
+
+        self.assertEqual(ids, [1, None, 3])
+
+    async def test_empty_batch(self):
+        self.assertEqual(await db_module.insert_evaluations([]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import sys
+import os
+import datetime
+import unittest
+from decimal import Decimal
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+# Add backend/app directory to sys.path so the routers/core packages resolve
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+import core.database as db_module
+from routers.evaluator import evaluator_app
+
+
+def evaluation_row(row_id: int, roll_no: str, total: str) -> dict:
+    """Shaped like an asyncpg Record from SELECT * FROM evaluations."""
+    return {
+        "id": row_id,
+        "roll_no": roll_no,
+        "exam_id": "EXAM1",
+        "marks": '{"Q1": 1.0, "Q11": 3.5}',
+        "feedback": '{"Q1": "Correct"}',
+        "total": Decimal(total),
+        "timestamp": datetime.datetime(2026, 1, 5, 10, 30),
+        "subject": "Maths",
+        "batch": "2023-2026",
+        "department": "BCA",
+        "semester": "3",
+        "topics": "{}",
+        "exam_type": "CIA",
+    }
+
+
+class TestResultsStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.client = TestClient(evaluator_app)
+
+    def stream_rows(self, rows):
+        async def fake_iter(exam_id, prefetch=200):
+            for r in rows:
+                yield db_module._evaluation_record(r)
+        return patch.object(db_module, "iter_evaluation_results", fake_iter)
+
+    def test_results_stream_serializes_decimal_totals(self):
+        """DECIMAL totals must not break the streamed JSON array mid-response."""
+        rows = [evaluation_row(1, "21CS001", "4.50"), evaluation_row(2, "21CS002", "12.00")]
+        with self.stream_rows(rows):
+            response = self.client.get("/results/EXAM1")
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual([r["roll_no"] for r in body], ["21CS001", "21CS002"])
+        self.assertEqual([r["total"] for r in body], [4.5, 12.0])
+        self.assertEqual(body[0]["_id"], "1")
+        self.assertEqual(body[0]["marks"], {"Q1": 1.0, "Q11": 3.5})
+
+    def test_results_stream_empty(self):
+        with self.stream_rows([]):
+            response = self.client.get("/results/EXAM1")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+
+    def test_export_excel_returns_whole_workbook(self):
+        rows = [evaluation_row(1, "21CS001", "4.50"), evaluation_row(2, "21CS002", "12.00")]
+        with self.stream_rows(rows):
+            response = self.client.get("/export-excel", params={"exam_id": "EXAM1"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content.startswith(b"PK"))
+        self.assertEqual(int(response.headers["content-length"]), len(response.content))
+        self.assertIn("results_EXAM1_detailed.xlsx", response.headers["content-disposition"])
+
+    def test_export_excel_closes_cursor_on_bad_question_key(self):
+        closed = []
+
+        async def fake_iter(exam_id, prefetch=200):
+            try:
+                yield db_module._evaluation_record({**evaluation_row(1, "21CS001", "4.50"), "marks": '{"Total": 1.0}'})
+                yield db_module._evaluation_record(evaluation_row(2, "21CS002", "12.00"))
+            finally:
+                closed.append(exam_id)
+
+        with patch.object(db_module, "iter_evaluation_results", fake_iter):
+            response = self.client.get("/export-excel", params={"exam_id": "EXAM1"})
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(closed, ["EXAM1"])
+
+
+if __name__ == '__main__':
+    unittest.main()
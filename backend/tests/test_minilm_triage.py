@@ -0,0 +1,90 @@
+import sys
+import os
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+# Add backend/app directory to sys.path so the routers package resolves
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+import routers.evaluator as evaluator
+from fakes import FakeMiniLM
+
+
+def axis(i: int, dim: int = 8) -> np.ndarray:
+    v = np.zeros(dim, dtype=np.float32)
+    v[i] = 1.0
+    return v
+
+
+class FakeEmbeddingCache:
+
+    def get_or_encode(self, model, texts, model_name):
+        return np.asarray(model.encode(texts), dtype=np.float32)
+
+
+class TestMiniLMTriage(unittest.TestCase):
+
+    def run_triage(self, vectors, batch):
+        with patch.object(evaluator, "minilm_model", FakeMiniLM(vectors, dim=8)), \
+             patch.object(evaluator, "embedding_cache", FakeEmbeddingCache()):
+            rubric_vecs = evaluator.minilm_rubric_vectors({item["id"]: item["rubric"] for item in batch})
+            return evaluator.triage_with_minilm(batch, rubric_vecs)
+
+    def test_accepted_scores_are_rounded_to_half_marks(self):
+        answer = "Backpropagation applies the chain rule"
+        vectors = {
+            "Chain rule over layers (5)": axis(0),
+            answer: 0.93 * axis(0) + np.sqrt(1 - 0.93 ** 2) * axis(1),
+        }
+        batch = [{"id": "11", "rubric": "Chain rule over layers (5)", "student_ans": answer, "max": 5}]
+
+        needs_llm, decided, _ = self.run_triage(vectors, batch)
+
+        self.assertEqual(needs_llm, [])
+        self.assertEqual(decided["11"]["score"], 4.5)
+
+    def test_or_question_is_compared_to_each_option(self):
+        """An answer to option B must not be diluted by option A's text."""
+        rubric = "Explain CNNs (10)\n[OR Rubric]: Explain RNNs (10)"
+        answer = "RNNs keep a hidden state across time steps"
+        vectors = {
+            "Explain CNNs (10)": axis(0),
+            "Explain RNNs (10)": axis(1),
+            rubric: (axis(0) + axis(1)) / np.sqrt(2),
+            answer: axis(1),
+        }
+        batch = [{"id": "16", "rubric": rubric, "student_ans": answer, "max": 10}]
+
+        needs_llm, decided, _ = self.run_triage(vectors, batch)
+
+        self.assertEqual(needs_llm, [])
+        self.assertEqual(decided["16"]["score"], 10.0)
+
+    def test_rubric_vectors_fall_back_per_item(self):
+        rubric = "Explain CNNs (10)\n[OR Rubric]: Explain RNNs (10)"
+        vectors = {"Explain CNNs (10)": axis(0), "Explain RNNs (10)": axis(1), "cnn answer": axis(0)}
+        batch = [{"id": "16", "rubric": rubric, "student_ans": "cnn answer", "max": 10}]
+
+        with patch.object(evaluator, "minilm_model", FakeMiniLM(vectors, dim=8)), \
+             patch.object(evaluator, "embedding_cache", FakeEmbeddingCache()):
+            sims = evaluator.minilm_similarities(batch)
+            fallback = evaluator.fallback_grade_with_minilm(batch)
+
+        self.assertAlmostEqual(float(sims[0]), 1.0, places=5)
+        self.assertEqual(fallback, {"16": 10.0})
+
+    def test_fallback_leaves_unscored_answers_out_when_encoding_fails(self):
+        class BrokenMiniLM:
+            def encode(self, texts, **kwargs):
+                raise RuntimeError("Already borrowed")
+
+        batch = [{"id": "11", "rubric": "Chain rule over layers (5)", "student_ans": "chain rule", "max": 5}]
+        with patch.object(evaluator, "minilm_model", BrokenMiniLM()), \
+             patch.object(evaluator, "embedding_cache", FakeEmbeddingCache()):
+            self.assertEqual(evaluator.fallback_grade_with_minilm(batch, {"11": np.stack([axis(0)])}), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import sys
+import os
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import json
+
+import fitz
+
+# Add backend/app directory to sys.path so the services package resolves
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+import services.question_generator as qg
+
+
+def fake_gemini(*responses):
+    """Stands in for genai.GenerativeModel; each generate_content_async call returns the next response text."""
+    model = MagicMock()
+    model.generate_content_async = AsyncMock(side_effect=[MagicMock(text=r) for r in responses])
+    return MagicMock(return_value=model), model
+
+
+class TestQuestionGenerator(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        qg._UNITS_CACHE.clear()
+        patches = [
+            patch.object(qg, "GENERATION_RATE_LIMIT", MagicMock(acquire=AsyncMock())),
+            patch.object(qg, "sync_knowledge_graph", AsyncMock()),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def make_pdf(self, text: str) -> str:
+        fd, path = tempfile.mkstemp(suffix=".pdf")
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        with fitz.open() as doc:
+            page = doc.new_page()
+            page.insert_textbox(fitz.Rect(36, 36, 560, 800), text)
+            doc.save(path)
+        return path
+
+    # --- extract_units_and_topics_unified Tests ---
+
+    async def test_extract_units_returns_parsed_units(self):
+        """Units come back from the (mocked) Gemini call and are cached per file."""
+        pdf_path = self.make_pdf("Unit 1: Sets and relations, functions, counting principles. " * 5)
+        units_json = '[{"unit": "Unit 1: Sets", "text": "Sets and relations", "topics": ["Sets", "Relations"]}]'
+        model_cls, model = fake_gemini(units_json)
+
+        with patch.object(qg.genai, "GenerativeModel", model_cls):
+            units = await qg.extract_units_and_topics_unified(pdf_path, "Maths")
+            again = await qg.extract_units_and_topics_unified(pdf_path, "Maths")
+
+        self.assertEqual(units, [{"unit": "Unit 1: Sets", "text": "Sets and relations", "topics": ["Sets", "Relations"]}])
+        self.assertEqual(again, units)
+        self.assertEqual(model.generate_content_async.await_count, 1)
+        qg.sync_knowledge_graph.assert_called_once_with("Maths", ["Sets", "Relations"])
+
+    # --- generate_question_paper Tests ---
+
+    async def test_generate_question_paper_numbers_sections_in_order(self):
+        """All three sections are generated and ids run MCQ -> Short -> Long."""
+        def respond(prompt, **kwargs):
+            if "Multiple Choice" in prompt:
+                questions = [{"question": f"MCQ {i}", "options": {"A": "a", "B": "b", "C": "c", "D": "d"}, "answer": "A"} for i in range(10)]
+            elif "Short Answer" in prompt:
+                questions = [{"question": f"Short {i}", "answer": "- Point (4)"} for i in range(10)]
+            else:
+                questions = [{"question": f"Long {i}", "answer": "- Point (10)"} for i in range(4)]
+            return MagicMock(text=json.dumps({"questions": questions}))
+
+        model = MagicMock()
+        model.generate_content_async = AsyncMock(side_effect=respond)
+
+        with patch.object(qg.genai, "GenerativeModel", MagicMock(return_value=model)), patch.object(qg, "embedding", None):
+            paper = await qg.generate_question_paper(("Sets and relations.", "Functions."), "Maths", "CIA", "Medium", ["Sets"])
+
+        self.assertEqual([len(paper[s]) for s in ("MCQ", "Short", "Long")], [10, 10, 4])
+        ids = [q["id"] for s in ("MCQ", "Short", "Long") for q in paper[s]]
+        self.assertEqual(ids, list(range(1, 25)))
+        self.assertEqual(paper["Short"][0]["type"], "Short Answer")
+        self.assertEqual(paper["Long"][0]["marks"], 10)
+        self.assertEqual(model.generate_content_async.await_count, 3)
+
+
+class TestJoinContext(unittest.TestCase):
+
+    def test_stops_before_the_chunk_that_would_overflow(self):
+        chunks = ["a" * 40, "b" * 40, "c" * 40]
+        context = qg.join_context(chunks, budget=100, sep="|")
+        self.assertEqual(context, "a" * 40 + "|" + "b" * 40)
+
+    def test_exact_fit_keeps_every_chunk(self):
+        self.assertEqual(qg.join_context(["ab", "cd"], budget=5, sep="|"), "ab|cd")
+
+    def test_first_chunk_is_kept_whole(self):
+        self.assertEqual(qg.join_context(["x" * 20, "y"], budget=10), "x" * 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import sys
+import os
+import asyncio
+import unittest
+
+# Add backend/app directory to sys.path so the utils package resolves
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+from utils.rate_limit import AsyncTokenBucket
+
+
+class TestAsyncTokenBucket(unittest.IsolatedAsyncioTestCase):
+
+    async def timed_acquires(self, bucket: AsyncTokenBucket, n: int) -> list:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        times = []
+        for _ in range(n):
+            await bucket.acquire()
+            times.append(loop.time() - start)
+        return times
+
+    async def test_burst_goes_out_immediately(self):
+        times = await self.timed_acquires(AsyncTokenBucket(rpm=60, burst=3), 3)
+        self.assertLess(times[-1], 0.05)
+
+    async def test_refill_rate_limits_past_the_burst(self):
+        # 1200 rpm = one token every 50ms once the 2-token burst is spent
+        times = await self.timed_acquires(AsyncTokenBucket(rpm=1200, burst=2), 4)
+        self.assertLess(times[1], 0.02)
+        self.assertGreaterEqual(times[2], 0.045)
+        self.assertGreaterEqual(times[3], 0.095)
+
+    async def test_concurrent_waiters_each_get_their_own_slot(self):
+        bucket = AsyncTokenBucket(rpm=1200, burst=1)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+
+        async def one():
+            await bucket.acquire()
+            return loop.time() - start
+
+        times = sorted(await asyncio.gather(*(one() for _ in range(3))))
+        self.assertLess(times[0], 0.02)
+        self.assertGreaterEqual(times[1], 0.045)
+        self.assertGreaterEqual(times[2], 0.095)
+
+
+if __name__ == '__main__':
+    unittest.main()
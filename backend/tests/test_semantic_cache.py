@@ -0,0 +1,107 @@
+import sys
+import os
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import numpy as np
+
+# Add backend/app directory to sys.path so the services/routers packages resolve
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+from services.semantic_cache import SemanticCache
+import routers.evaluator as evaluator
+from fakes import FakeMiniLM, unit_vec
+
+
+class TestSemanticCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, "grade_cache.npz")
+
+    def test_lookup_is_scoped(self):
+        """An identical vector only hits inside the scope it was stored under."""
+        cache = SemanticCache(path=self.path)
+        v = unit_vec(1)
+        cache.add([v], [{"score": 4.0, "feedback": "ok", "topic": "T"}], ["k1"], ["EXAM1|Q11"])
+
+        self.assertEqual(cache.lookup(np.stack([v]), ["EXAM1|Q11"])[0]["score"], 4.0)
+        self.assertIsNone(cache.lookup(np.stack([v]), ["EXAM1|Q12"])[0])
+        self.assertIsNone(cache.lookup(np.stack([v]), ["EXAM2|Q11"])[0])
+
+    def test_different_answers_do_not_match(self):
+        cache = SemanticCache(path=self.path)
+        cache.add([unit_vec(1)], [{"score": 4.0, "feedback": "ok", "topic": "T"}], ["k1"], ["S"])
+        self.assertIsNone(cache.lookup(np.stack([unit_vec(2)]), ["S"])[0])
+
+    def test_exact_key_normalizes_answer_but_not_scope(self):
+        self.assertEqual(SemanticCache.exact_key("S", "Photosynthesis  uses light"), SemanticCache.exact_key("S", "photosynthesis uses LIGHT"))
+        self.assertNotEqual(SemanticCache.exact_key("S", "uses light"), SemanticCache.exact_key("S", "uses water"))
+        self.assertNotEqual(SemanticCache.exact_key("S1", "uses light"), SemanticCache.exact_key("S2", "uses light"))
+
+    def test_save_and_load_round_trip_without_pickle(self):
+        cache = SemanticCache(path=self.path)
+        cache.add([unit_vec(1)], [{"score": 2.5, "feedback": "fine", "topic": "T"}], ["k1"], ["S"])
+        cache.save()
+
+        self.assertEqual(os.listdir(self.tmp.name), ["grade_cache.npz"])
+        with np.load(self.path, allow_pickle=False) as data:
+            self.assertEqual(data["values"].dtype.kind, "U")
+
+        reloaded = SemanticCache(path=self.path)
+        self.assertEqual(len(reloaded), 1)
+        self.assertEqual(reloaded.get("k1"), {"score": 2.5, "feedback": "fine", "topic": "T"})
+        self.assertEqual(reloaded.lookup(np.stack([unit_vec(1)]), ["S"])[0]["score"], 2.5)
+
+
+class TestGradeBatchCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.minilm = FakeMiniLM()
+        self.gemini = AsyncMock(side_effect=lambda prompt: MagicMock(text='{"11": {"score": 3.5, "feedback": "ok", "topic": "T"}}'))
+        patches = [
+            patch.object(evaluator, "grade_cache", SemanticCache(path=os.path.join(tmp.name, "grade_cache.npz"))),
+            patch.object(evaluator, "minilm_model", self.minilm),
+            patch.object(evaluator, "gemini_model", MagicMock()),
+            patch.object(evaluator, "call_gemini_api_safe", self.gemini),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def item(self, answer: str) -> dict:
+        return {"id": "11", "question": "Define photosynthesis.", "rubric": "- Definition (2)\n- Equation (2)", "student_ans": answer, "max": 4}
+
+    async def test_other_students_answers_are_graded_separately(self):
+        await evaluator.grade_batch_with_gemini([self.item("Plants turn light into chemical energy.")], "EXAM1")
+        await evaluator.grade_batch_with_gemini([self.item("It is when animals breathe oxygen.")], "EXAM1")
+        self.assertEqual(self.gemini.await_count, 2)
+        # Only answers are embedded, never the rubric
+        self.assertTrue(all("Definition" not in text for text in self.minilm.seen))
+
+    async def test_repeated_answer_reuses_grade_within_exam_only(self):
+        first = await evaluator.grade_batch_with_gemini([self.item("Plants turn light into chemical energy.")], "EXAM1")
+        again = await evaluator.grade_batch_with_gemini([self.item("plants turn light into  chemical energy.")], "EXAM1")
+        self.assertEqual(again, first)
+        self.assertEqual(self.gemini.await_count, 1)
+
+        await evaluator.grade_batch_with_gemini([self.item("Plants turn light into chemical energy.")], "EXAM2")
+        self.assertEqual(self.gemini.await_count, 2)
+
+    async def test_triage_embeddings_are_reused(self):
+        answer = "Plants turn light into chemical energy."
+        await evaluator.grade_batch_with_gemini([self.item(answer)], "EXAM1", np.stack([unit_vec(3)]))
+        self.assertEqual(self.minilm.seen, [])
+
+        # The stored vector is the one passed in, so a later lookup with it hits
+        again = await evaluator.grade_batch_with_gemini([self.item("A different wording.")], "EXAM1", np.stack([unit_vec(3)]))
+        self.assertEqual(again["11"]["score"], 3.5)
+        self.assertEqual(self.gemini.await_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
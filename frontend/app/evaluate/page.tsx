@@ -183,7 +183,16 @@ export default function EvaluatePage() {
                     } else if (event.type === "complete") {
                         setResults(event.results);
                         setStep(4);
-                        showToast("Evaluation complete!", "success");
+                        const fallbackCount = Object.values(event.fallback_graded ?? {}).reduce((n, qs) => n + qs.length, 0);
+                        if (event.failed?.length) {
+                            showToast(`Evaluation finished, but ${event.failed.length} paper(s) could not be graded: ${event.failed.map((f) => f.file).join(", ")}`, "error");
+                        } else if (event.unsaved?.length) {
+                            showToast(`Evaluation finished, but results for ${event.unsaved.join(", ")} could not be saved`, "error");
+                        } else if (fallbackCount) {
+                            showToast(`Evaluation complete. ${fallbackCount} answer(s) could not be graded by AI; please review them.`, "success");
+                        } else {
+                            showToast("Evaluation complete!", "success");
+                        }
                     } else if (event.type === "error") {
                         showToast(event.message, "error");
                     }
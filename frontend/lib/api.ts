@@ -268,7 +268,7 @@ export interface EvaluatePayload {
     semester?: string;
 }
 
-export type StreamEventHandler = (event: { type: "progress"; value: number; message: string } | { type: "complete"; results: EvaluationResult[] } | { type: "error"; message: string }) => void;
+export type StreamEventHandler = (event: { type: "progress"; value: number; message: string } | { type: "complete"; status: "success" | "partial"; results: EvaluationResult[]; failed: { file: string; error: string }[]; unsaved: string[]; fallback_graded: Record<string, string[]> } | { type: "error"; message: string }) => void;
 
 export async function evaluate(payload: EvaluatePayload, onEvent: StreamEventHandler): Promise<void> {
     const formData = new FormData();